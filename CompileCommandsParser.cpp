@@ -6,6 +6,7 @@
 #include "llvm/Support/raw_ostream.h"
 #include "llvm/Support/FileSystem.h"
 #include "llvm/Support/Path.h"
+#include <cstdlib>
 #include <fstream>
 
 using namespace llvm;
@@ -142,6 +143,18 @@ std::vector<std::string> CompileCommandsParser::getBitcodeFiles() const {
         if (dot_pos != std::string::npos) {
             bc_file = bc_file.substr(0, dot_pos) + ".bc";
             
+            // 与 ccjson_to_bc.py 一致：设置 BC_OUTPUT_DIR 时.bc文件按源码树结构存放在该目录下
+            const char* output_root = std::getenv("BC_OUTPUT_DIR");
+            if (output_root && *output_root) {
+                SmallString<256> abs_bc(bc_file);
+                sys::fs::make_absolute(abs_bc);
+                sys::path::remove_dots(abs_bc, /*remove_dot_dot=*/true);
+                SmallString<256> mirrored(output_root);
+                sys::fs::make_absolute(mirrored);  // 相对路径按当前目录解析，与 ccjson_to_bc.py 一致
+                sys::path::append(mirrored, sys::path::relative_path(abs_bc));
+                bc_file = mirrored.str().str();
+            }
+            
             // 检查.bc文件是否存在
             if (sys::fs::exists(bc_file)) {
                 bitcode_files.push_back(bc_file);
@@ -0,0 +1,257 @@
+# _flags.py - compile_commands.json 编译参数的解析与过滤
+# 只包含纯字符串处理，不依赖 pathlib/subprocess，可直接在 PyPy 下运行
+import functools, os, re, shlex
+
+OPTIMIZATION = os.environ.get("OPTIMIZATION", "-O0")  # 使用-O1优化等级
+
+# 为静态分析过滤掉的标志
+SANITIZER_FLAGS = frozenset({
+    "-fsanitize=kernel-address", "-fsanitize-address-use-after-scope", 
+    "-fasan-shadow-offset=0xdffffc0000000000", "-fsanitize=address",
+    "-fsanitize-coverage=trace-pc", "-fsanitize-coverage=trace-cmp",
+    "-fsanitize-coverage=trace-div", "-fsanitize-coverage=trace-gep",
+    "-fsanitize-coverage=indirect-calls", "-fsanitize-coverage=trace-pc-guard",
+    "-fsanitize=undefined", "-fsanitize=integer", "-fsanitize=nullability"
+})
+
+PROFILING_FLAGS = frozenset({
+    "-fprofile-instr-generate", "-fprofile-instr-use",
+    "-fprofile-generate", "-fprofile-use",
+    "-fcoverage-mapping", "-fprofile-arcs", "-ftest-coverage"
+})
+
+SECURITY_FLAGS = frozenset({
+    "-fstack-protector", "-fstack-protector-strong", "-fstack-protector-all",
+    "-fstack-clash-protection", "-fcf-protection"
+})
+
+DEBUG_FLAGS = frozenset({
+    "-gsplit-dwarf", "-gdwarf-5", "-gno-pubnames"
+})
+
+# options that take a separate next-arg and we want to KEEP both
+KEEP_PAIR = frozenset({"-I", "-isystem", "-idirafter", "-iprefix", "-include", "-imacros"})
+# options we ALWAYS drop, plus their next-arg if they take one
+DROP_SINGLE = frozenset({"-c", "-E", "-pipe", "-MMD", "-MD", "-MP"})
+DROP_PAIR = frozenset({"-o", "-Wp,", "-MF", "-MT", "-MQ"})
+# 需要完整匹配过滤的插桩、性能分析和安全加固标志
+DROP_EXACT = SANITIZER_FLAGS | PROFILING_FLAGS | SECURITY_FLAGS
+
+# 以下前缀元组只构建一次，str.startswith 可一次匹配全部前缀
+# 插桩和性能分析相关的前缀
+DROP_PREFIXES = (
+    "-fsanitize", "-fno-sanitize", "-fprofile", "-fcoverage",
+    "-fstack-protector", "-fcf-protection", "-fstack-clash"
+)
+# 需要保留的重要编译选项
+KEEP_PREFIXES = (
+    "-D", "-U", "-I", "-isystem", "-include", "-idirafter", "-iprefix",
+    "-nostdinc", "-f", "-m", "-W", "-std=", "-mcmodel=", "-march=", "-mtune="
+)
+# 不必要的警告选项
+WARNING_DROP_PREFIXES = ("-Wno-", "-Werror")
+# 架构和平台相关选项
+ARCH_PREFIXES = ("-m32", "-m64", "-march", "-mtune", "-mcpu")
+# 需要替换为 OPTIMIZATION 的优化级别
+OPT_LEVELS = frozenset({"-O0", "-O2", "-O3", "-Os", "-Oz"})
+
+WRAPPER_PREFIXES = ("ccache", "sccache", "distcc", "icecc")
+
+# 不含引号和反斜杠的命令行，shlex(posix) 的结果就是按空白切分
+_SHLEX_SPECIAL = re.compile(r"[\"'\\]")
+_SHLEX_WORD = re.compile(r"[^ \t\r\n]+")
+
+
+def norm_args(entry):
+    """标准化编译参数"""
+    args = entry.get("arguments")
+    if args:
+        return args  # 只读使用，无需拷贝
+    command = entry.get("command", "")
+    if not _SHLEX_SPECIAL.search(command):
+        return _SHLEX_WORD.findall(command)
+    return shlex.split(command, posix=True)
+
+
+def may_be_kernel(entry):
+    """在切分参数之前快速排除不含 -D__KERNEL__ 的条目"""
+    args = entry.get("arguments")
+    if args:
+        return "-D__KERNEL__" in args
+    command = entry.get("command", "")
+    # 含引号或反斜杠时切分后才能确定，交给后续的完整检查
+    return "-D__KERNEL__" in command or _SHLEX_SPECIAL.search(command) is not None
+
+
+def is_c_compile(args):
+    """检查是否是C编译命令"""
+    return ("-c" in args) and any(a.endswith(".c") for a in args) and ("-E" not in args)
+
+
+def pick_src(args):
+    """选择源文件"""
+    srcs = [a for a in args if a.endswith(".c")]
+    return srcs[-1] if srcs else None
+
+
+def is_flag_to_drop(flag):
+    """检查是否是需要过滤的标志"""
+    # 检查完整匹配
+    if flag in DROP_EXACT:
+        return True
+    
+    # 检查前缀匹配
+    return flag.startswith(DROP_PREFIXES)
+
+
+# 单个参数的处理动作
+FLAG_SKIP = 0       # 丢弃该参数
+FLAG_SKIP_PAIR = 1  # 丢弃该参数及其后一个参数
+FLAG_KEEP = 2       # 保留该参数
+FLAG_KEEP_PAIR = 3  # 保留该参数及其后一个参数
+FLAG_OPT = 4        # 替换为 OPTIMIZATION
+FLAG_DEBUG = 5      # 统一为 -g
+
+
+@functools.lru_cache(maxsize=None)
+def classify_flag(a, has_next=True):
+    """判定单个参数的处理动作，同一参数只需判定一次"""
+    # drop '-mllvm <param>'
+    if a == "-mllvm":
+        return FLAG_SKIP_PAIR
+
+    # 过滤所有插桩和性能分析标志
+    if is_flag_to_drop(a):
+        return FLAG_SKIP
+
+    # drop singles
+    if a in DROP_SINGLE or a.startswith("-Wp,"):
+        return FLAG_SKIP
+
+    # drop pairs we don't need
+    if a in DROP_PAIR:
+        return FLAG_SKIP_PAIR
+
+    # keep pair options (and their next argument)
+    if a in KEEP_PAIR and has_next:
+        return FLAG_KEEP_PAIR
+
+    # 替换优化级别为分析友好的级别
+    if a in OPT_LEVELS:
+        return FLAG_OPT
+
+    # 保留调试信息但使用标准格式，跳过禁用调试信息
+    if a.startswith("-g"):
+        return FLAG_SKIP if a == "-g0" else FLAG_DEBUG
+
+    # 保留重要的编译选项，跳过一些不必要的警告选项
+    if a.startswith(KEEP_PREFIXES):
+        return FLAG_SKIP if a.startswith(WARNING_DROP_PREFIXES) else FLAG_KEEP
+
+    # 保留架构和平台相关选项
+    if a.startswith(ARCH_PREFIXES):
+        return FLAG_KEEP
+
+    # 其他情况忽略
+    return FLAG_SKIP
+
+
+def filter_flags_for_analysis(args):
+    """为静态分析过滤编译标志"""
+    out = []
+    seen = set()  # out 中已有的参数，用于去重
+    n = len(args)
+    i = 1  # skip compiler name at args[0]
+
+    while i < n:
+        a = args[i]
+        action = classify_flag(a, i + 1 < n)
+
+        if action == FLAG_KEEP:
+            out.append(a)
+            seen.add(a)
+        elif action == FLAG_SKIP_PAIR:
+            i += 1
+        elif action == FLAG_KEEP_PAIR:
+            i += 1
+            out.append(a)
+            out.append(args[i])
+            seen.add(a)
+            seen.add(args[i])
+        elif action == FLAG_OPT:
+            if OPTIMIZATION not in seen:  # 避免重复
+                out.append(OPTIMIZATION)
+                seen.add(OPTIMIZATION)
+        elif action == FLAG_DEBUG:
+            if "-g" not in seen:  # 避免重复调试标志
+                out.append("-g")
+                seen.add("-g")
+        i += 1
+
+    # 添加静态分析友好的选项
+    analysis_flags = [
+        "-Wno-unknown-warning-option",
+        "-Wno-unused-command-line-argument", 
+        "-fno-discard-value-names",  # 保留变量名用于分析
+        "-disable-llvm-passes",      # 禁用LLVM优化以保持IR清晰
+    ]
+    
+    for flag in analysis_flags:
+        if flag not in seen:
+            out.append(flag)
+    
+    return out
+
+
+# 会吞掉下一个参数的选项
+PAIR_OPTIONS = KEEP_PAIR | DROP_PAIR | frozenset({"-mllvm"})
+
+
+# kbuild 为每个翻译单元生成不同取值的宏定义
+PER_TU_DEFINE_PREFIXES = ("-DKBUILD_", "-D__KBUILD_")
+# 缓存键中代替这些宏定义的占位参数，同样按 -D 选项保留；argv 中不会出现 NUL
+PER_TU_SLOT = "-D\0"
+
+
+def flags_key(args, src):
+    """得到可在翻译单元之间共享的参数模板，返回 (参数元组, 本翻译单元的宏定义列表)
+
+    去掉源文件、-o 输出参数和过滤时总会丢弃的 -Wp,<依赖文件> 参数，
+    kbuild 的 KBUILD_* 宏定义换成占位参数，过滤后再按顺序填回；
+    只处理不作为其他选项参数的位置上的 token，过滤结果与原参数一致
+    """
+    key = []
+    defines = []
+    n = len(args)
+    i = 0
+    while i < n:
+        a = args[i]
+        if i > 0 and args[i - 1] not in PAIR_OPTIONS:
+            if a == "-o":
+                i += 2
+                continue
+            if a == src or (a.startswith("-Wp,") and a != "-Wp,"):
+                i += 1
+                continue
+            if a.startswith(PER_TU_DEFINE_PREFIXES):
+                defines.append(a)
+                a = PER_TU_SLOT
+        key.append(a)
+        i += 1
+    return tuple(key), defines
+
+
+@functools.lru_cache(maxsize=1024)
+def filter_flags_cached(argv):
+    """按参数模板缓存过滤结果，同一目录下的翻译单元通常共用同一套编译选项"""
+    return tuple(filter_flags_for_analysis(argv))
+
+
+def filter_flags_template(args, src):
+    """通过参数模板缓存过滤编译参数，返回过滤后的参数元组"""
+    key, defines = flags_key(args, src)
+    flags = filter_flags_cached(key)
+    if not defines:
+        return flags
+    it = iter(defines)
+    return tuple(next(it) if a == PER_TU_SLOT else a for a in flags)
@@ -0,0 +1,555 @@
+# ccjson_common.py - compile_commands.json 生成bitcode的公共驱动逻辑
+# 命令行入口 (ccjson_to_bc.py) 只负责参数解析和提示信息，编译流程都在这里
+import functools, hashlib, json, mmap, os, shutil, subprocess, threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import _flags
+from _flags import (OPTIMIZATION, filter_flags_template, is_c_compile, may_be_kernel, norm_args,
+                    pick_src)
+
+try:
+    import orjson  # 直接接受 bytes/memoryview，免去 UTF-8 解码和 str 拷贝
+except ImportError:
+    orjson = None
+
+try:
+    import ijson
+    # 纯Python后端比整体解析慢得多，只在C后端可用时流式解析
+    if ijson.backend != "yajl2_c":
+        ijson = None
+except ImportError:
+    ijson = None
+
+JSON_ERRORS = (json.JSONDecodeError,) if ijson is None else (json.JSONDecodeError, ijson.JSONError)
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    from blake3 import blake3 as _new_hasher
+except ImportError:
+    _new_hasher = functools.partial(hashlib.blake2b, digest_size=32)
+
+
+def resolve_executable(name):
+    """解析为绝对路径，避免每次启动子进程都按 PATH 逐个目录尝试 exec"""
+    return shutil.which(name) or name
+
+
+CLANG = resolve_executable(os.environ.get("CLANG", "clang"))
+TARGET = os.environ.get("TARGET", "")
+# 内容哈希缓存目录，为空时不启用 (缓存键不包含头文件内容)
+BC_CACHE_DIR = os.environ.get("BC_CACHE_DIR", "")
+# .bc输出根目录 (如 /dev/shm/bc_cache)，按源码树结构存放；为空时输出到源文件同目录
+# clang在各条目的工作目录下运行，相对路径需先按当前目录解析为绝对路径
+BC_OUTPUT_DIR = os.environ.get("BC_OUTPUT_DIR", "")
+if BC_OUTPUT_DIR:
+    BC_OUTPUT_DIR = os.path.abspath(BC_OUTPUT_DIR)
+# 编译后用llvm-nm检查.bc中是否残留插桩符号
+VERIFY = os.environ.get("VERIFY", "") not in ("", "0")
+LLVM_NM = resolve_executable(os.environ.get("LLVM_NM", "llvm-nm"))
+
+# 插桩和性能分析运行时的符号前缀
+INSTRUMENTATION_SYMBOL_PREFIXES = (
+    "__asan_", "__hwasan_", "__kasan_", "__msan_", "__tsan_", "__ubsan_",
+    "__sanitizer_cov_", "__llvm_profile_", "__llvm_gcov_", "__gcov_"
+)
+
+
+def default_jobs():
+    """默认并行编译任务数：CPU核数"""
+    return os.cpu_count() or 1
+
+
+@functools.lru_cache(maxsize=None)
+def clang_version():
+    """获取编译器版本信息，作为缓存键的一部分"""
+    try:
+        result = subprocess.run([CLANG, "--version"], capture_output=True, text=True, timeout=60)
+    except (OSError, subprocess.TimeoutExpired):
+        return ""
+    return result.stdout
+
+
+@functools.lru_cache(maxsize=None)
+def integrated_cc1_flags():
+    """检测clang是否支持 -fintegrated-cc1
+
+    启用后前端在driver进程内运行，每个翻译单元少启动一个clang子进程
+    (部分发行版或设置了 CLANG_SPAWN_CC1 时默认另起子进程)
+    """
+    probe = [CLANG, "-fintegrated-cc1", "-###", "-x", "c", "-c", os.devnull]
+    try:
+        result = subprocess.run(probe, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, timeout=60)
+    except (OSError, subprocess.TimeoutExpired):
+        return ()
+    return ("-fintegrated-cc1",) if result.returncode == 0 else ()
+
+
+def cache_key(src_path, cwd, cmd):
+    """根据源文件内容、工作目录、编译命令和编译器版本计算缓存键"""
+    h = _new_hasher()
+    with open(src_path, "rb") as f:
+        h.update(f.read())
+    for part in (cwd, *cmd, clang_version()):
+        h.update(b"\0")
+        h.update(part.encode())
+    return h.hexdigest()
+
+
+def link_or_copy(src, dst):
+    """把 src 硬链接到 dst (跨文件系统时退化为复制)，原子地替换已有文件"""
+    dst_dir, dst_name = os.path.split(dst)
+    tmp = os.path.join(dst_dir, f".{dst_name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    try:
+        try:
+            os.link(src, tmp)
+        except OSError:
+            shutil.copy2(src, tmp)
+        os.replace(tmp, dst)
+    finally:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+
+
+def compile_command(srcs, flags):
+    """构建编译命令 (不含输出路径)"""
+    cmd = [CLANG]
+    if TARGET:
+        cmd.append(f"--target={TARGET}")
+    cmd.extend(integrated_cc1_flags())
+    cmd.extend(["-emit-llvm", "-c"])
+    cmd.extend(str(src) for src in srcs)
+    cmd.extend(flags)
+    return cmd
+
+
+def run_clang(cmd, cwd, timeout=60):
+    """执行clang，返回 (是否成功, 输出信息行)"""
+    try:
+        # -c -o 成功时clang不向stdout输出，只捕获stderr用于报告错误；
+        # 不使用 shell/preexec_fn/user/group 等参数，CPython 可以用 vfork 启动子进程，
+        # 无需在线程池和大量任务占用内存时复制父进程页表
+        result = subprocess.run(cmd, cwd=cwd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+                                text=True, timeout=timeout)
+    except subprocess.TimeoutExpired:
+        return False, ["  ✗ 编译超时"]
+    except Exception as e:
+        return False, [f"  ✗ 编译异常: {e}"]
+
+    if result.returncode == 0:
+        return True, ["  ✓ 成功"]
+
+    lines = ["  ✗ 编译失败"]
+    if result.stderr.strip():
+        # 只显示关键错误
+        error_lines = result.stderr.strip().split('\n')
+        important_errors = [line for line in error_lines
+                            if any(keyword in line.lower()
+                                   for keyword in ['error:', 'fatal:', 'undefined'])]
+        if important_errors:
+            lines.append(f"     {important_errors[0]}")
+    return False, lines
+
+
+# 已创建的输出目录，避免每个文件都重复 mkdir/stat
+_created_dirs = set()
+
+
+def ensure_dir(path):
+    """创建输出目录，同一目录只创建一次"""
+    if path and path not in _created_dirs:
+        os.makedirs(path, exist_ok=True)
+        _created_dirs.add(path)
+
+
+def check_job(src, src_path, bc_path, cwd, flags, cache_dir=None):
+    """编译前检查源文件和缓存
+
+    返回 (结果, 缓存路径)：源文件缺失或命中缓存时结果为 (状态, 输出信息行)，
+    否则结果为 None，需要继续编译
+    """
+    missing = ("failed", [f"  ✗ 源文件不存在: {src_path}"]), None
+
+    if cache_dir is None:
+        # 检查源文件是否存在
+        try:
+            os.stat(src_path)
+        except OSError:
+            return missing
+        try:
+            ensure_dir(os.path.dirname(bc_path))
+        except OSError as e:
+            return ("failed", [f"  ✗ 无法创建输出目录: {e}"]), None
+        return None, None
+
+    # 读取源文件计算缓存键，同时完成存在性检查；输出路径不影响.bc内容，不参与缓存键
+    try:
+        key = cache_key(src_path, cwd, compile_command([src], flags))
+    except FileNotFoundError:
+        return missing
+    except OSError as e:
+        return ("failed", [f"  ✗ 无法读取源文件: {e}"]), None
+
+    cached = os.path.join(cache_dir, f"{key}.bc")
+    # 输出目录只读或空间不足等错误只让该文件失败，不中断整个运行
+    try:
+        ensure_dir(os.path.dirname(bc_path))
+        try:
+            link_or_copy(cached, bc_path)
+            return ("cached", ["  ✓ 缓存命中"]), cached
+        except FileNotFoundError:
+            pass
+        # 断开可能与缓存共享的硬链接，避免clang改写缓存内容
+        try:
+            os.unlink(bc_path)
+        except FileNotFoundError:
+            pass
+    except OSError as e:
+        return ("failed", [f"  ✗ 无法从缓存恢复: {e}"]), None
+    return None, cached
+
+
+def store_cache(bc_path, cached):
+    """把编译成功的.bc文件放入缓存"""
+    if cached is None:
+        return
+    try:
+        link_or_copy(bc_path, cached)
+    except OSError:
+        pass  # 缓存写入失败不影响编译结果
+
+
+def compile_one(src, src_path, bc_path, cwd, flags, cached=None):
+    """编译单个源文件，返回 (状态, 输出信息行)，状态为 ok/failed"""
+    ok, lines = run_clang(compile_command([src], flags) + ["-o", bc_path], cwd)
+    if ok:
+        store_cache(bc_path, cached)
+    return ("ok" if ok else "failed"), lines
+
+
+def verify_bitcode_quality(bc_path):
+    """检查.bc是否残留插桩代码，返回输出信息行
+
+    只用llvm-nm读取符号表查找插桩运行时符号，不做完整反汇编
+    """
+    try:
+        result = subprocess.run([LLVM_NM, "--undefined-only", bc_path],
+                                capture_output=True, text=True, timeout=60)
+    except (OSError, subprocess.TimeoutExpired) as e:
+        return [f"  ⚠ 无法检查bitcode: {e}"]
+    if result.returncode != 0:
+        return [f"  ⚠ 无法检查bitcode: {result.stderr.strip()}"]
+
+    symbols = [line.split()[-1] for line in result.stdout.splitlines() if line.strip()]
+    leftovers = [sym for sym in symbols if sym.startswith(INSTRUMENTATION_SYMBOL_PREFIXES)]
+    if leftovers:
+        return [f"  ⚠ 残留插桩符号: {', '.join(leftovers[:5])}"]
+    return []
+
+
+def compile_group(jobs, cache_dir=None, verify=False):
+    """编译一组同目录、同编译选项的源文件，返回 [(任务, 状态, 输出信息行), ...]
+
+    多个文件时合并为一次clang调用，省去各自的driver进程 (clang仍为每个文件
+    启动cc1，并按顺序编译)，clang会把各自的.bc输出到工作目录下；
+    合并编译失败时逐个重新编译以得到每个文件的结果。只在clang不支持
+    -fintegrated-cc1 时才会合并，见 group_jobs()
+    """
+    results = []
+    pending = []
+    for job in jobs:
+        early, cached = check_job(*job, cache_dir=cache_dir)
+        if early is not None:
+            results.append((job, *early))
+        else:
+            pending.append((job, cached))
+
+    batched = False
+    if len(pending) > 1:
+        _, _, _, cwd, flags = pending[0][0]
+        cmd = compile_command([job[0] for job, _ in pending], flags)
+        batched, _ = run_clang(cmd, cwd, timeout=60 * len(pending))
+
+    for job, cached in pending:
+        if batched:
+            store_cache(job[2], cached)
+            results.append((job, "ok", ["  ✓ 成功"]))
+        else:
+            results.append((job, *compile_one(*job, cached=cached)))
+
+    if verify:
+        for job, status, lines in results:
+            if status != "failed":
+                lines.extend(verify_bitcode_quality(job[2]))
+    return results
+
+
+# 每次合并编译的最大文件数，合并的文件在一次调用中串行编译
+MAX_BATCH = 8
+
+
+def group_jobs(jobs, parallel):
+    """按 (工作目录, 编译选项) 把可合并编译的任务分组
+
+    只有源文件和.bc都直接位于工作目录下时，clang默认的输出路径才与
+    预期一致，其余任务单独成组。支持 -fintegrated-cc1 时单文件编译只需
+    一个进程，而多文件调用会另起cc1子进程，此时不合并；否则每组最多
+    MAX_BATCH 个文件，且不超过 ceil(任务数/并行数)，使所有线程都有任务可做
+    """
+    batch = min(MAX_BATCH, -(-len(jobs) // parallel))
+    if batch <= 1 or integrated_cc1_flags():
+        return [[job] for job in jobs]
+
+    groups = {}
+    singles = []
+    for job in jobs:
+        _, src_path, bc_path, cwd, flags = job
+        if (os.path.dirname(src_path) == os.path.normpath(cwd)
+                and bc_path == src_path[:-2] + ".bc"):
+            group = groups.setdefault((cwd, flags), {})
+            if bc_path not in group:
+                group[bc_path] = job
+                continue
+        singles.append([job])
+
+    batches = []
+    for group in groups.values():
+        group = list(group.values())
+        batches.extend(group[i:i + batch] for i in range(0, len(group), batch))
+    return batches + singles
+
+
+def stream_entries(db):
+    """逐条流式解析compile_commands.json，处理完的条目即可回收"""
+    with open(db, "rb") as f:
+        yield from ijson.items(f, "item")
+
+
+def load_entries(db):
+    """读取compile_commands.json中的条目"""
+    if ijson is not None:
+        return stream_entries(db)
+    if orjson is None:
+        return json.loads(db.read_bytes())
+
+    # orjson 直接解析内存映射，边缺页读入边解析，也省去一份整文件的 bytes 拷贝
+    with open(db, "rb") as f:
+        try:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            return orjson.loads(f.read())  # 空文件无法映射
+    with mm, memoryview(mm) as view:
+        return orjson.loads(view)
+
+
+def output_path(src_path):
+    """计算.bc输出路径"""
+    bc_path = src_path[:-2] + ".bc"  # pick_src 只选取 .c 文件
+    if not BC_OUTPUT_DIR:
+        # 保持在源文件相同目录下
+        return bc_path
+    # 在输出根目录下镜像源文件的绝对路径
+    return os.path.join(BC_OUTPUT_DIR, os.path.abspath(bc_path).lstrip(os.sep))
+
+
+def collect_jobs(entries):
+    """从compile_commands.json条目中筛选需要编译的内核C文件
+
+    返回 (任务列表, 重复条目数)，同一源文件以相同选项重复出现时只编译一次
+    """
+    jobs = []
+    seen = set()
+    dup = 0
+    for entry in entries:
+        # 仅处理内核代码，先用子串检查排除大部分主机工具条目
+        if not may_be_kernel(entry):
+            continue
+
+        args = norm_args(entry)
+        if not args or not is_c_compile(args):
+            continue
+            
+        # 切分后精确检查 -D__KERNEL__，含引号的命令无法在预检查中排除
+        if "-D__KERNEL__" not in args:
+            continue
+            
+        src = pick_src(args)
+        if not src:
+            continue
+        
+        # 路径只做字符串拼接，clang不需要规范化的绝对路径
+        cwd = entry.get("directory", ".")
+        # 绝对路径保持不变，相对路径拼接到工作目录下
+        src_path = os.path.join(cwd, src)
+        
+        # 应用清理过滤
+        flags = filter_flags_template(args, src)
+
+        # 跳过重复条目，无需访问文件系统
+        key = (os.path.normpath(src_path), flags)
+        if key in seen:
+            dup += 1
+            continue
+        seen.add(key)
+
+        # 计算输出 .bc 路径
+        bc_path = output_path(src_path)
+        
+        jobs.append((src, src_path, bc_path, cwd, flags))
+
+    return jobs, dup
+
+
+# 过滤结果边车文件的格式版本，格式变化时递增 (筛选和过滤规则的变化由代码指纹区分)
+JOBS_CACHE_VERSION = 1
+
+
+def jobs_cache_path(db):
+    """过滤后任务列表的边车文件路径"""
+    return db.with_suffix(".filtered.msgpack")
+
+
+@functools.lru_cache(maxsize=None)
+def filter_fingerprint():
+    """筛选和过滤代码的指纹，修改 _flags.py 或本模块后边车文件自动失效"""
+    h = _new_hasher()
+    for path in (_flags.__file__, __file__):
+        try:
+            with open(path, "rb") as f:
+                h.update(f.read())
+        except OSError:
+            return ""
+    return h.hexdigest()
+
+
+def jobs_cache_key(db):
+    """边车文件的有效性键：compile_commands.json的mtime和大小，以及影响筛选结果的代码和设置"""
+    st = os.stat(db)
+    return [JOBS_CACHE_VERSION, st.st_mtime_ns, st.st_size, filter_fingerprint(), OPTIMIZATION,
+            BC_OUTPUT_DIR]
+
+
+def read_jobs_cache(db):
+    """读取边车文件，键不匹配或文件无效时返回 None"""
+    try:
+        with open(jobs_cache_path(db), "rb") as f:
+            data = msgpack.unpackb(f.read(), raw=False)
+        if data["key"] != jobs_cache_key(db):
+            return None
+        # 编译选项模板只存一份，任务中按下标引用，读回后仍共享同一个元组
+        templates = [tuple(flags) for flags in data["flags"]]
+        jobs = [(src, src_path, bc_path, cwd, templates[index])
+                for src, src_path, bc_path, cwd, index in data["jobs"]]
+        return jobs, data["dup"]
+    except (OSError, ValueError, LookupError, TypeError, msgpack.UnpackException):
+        return None  # 边车文件不存在或损坏时重新解析；格式变化由 JOBS_CACHE_VERSION 区分
+
+
+def write_jobs_cache(db, jobs, dup):
+    """把过滤后的任务列表写入边车文件，写入失败不影响本次运行"""
+    templates = {}
+    packed_jobs = [(src, src_path, bc_path, cwd, templates.setdefault(flags, len(templates)))
+                   for src, src_path, bc_path, cwd, flags in jobs]
+    data = {"key": jobs_cache_key(db), "dup": dup, "flags": list(templates), "jobs": packed_jobs}
+    path = jobs_cache_path(db)
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    try:
+        with open(tmp, "wb") as f:
+            f.write(msgpack.packb(data, use_bin_type=True))
+        os.replace(tmp, path)
+    except OSError:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+
+
+def load_jobs(db):
+    """读取compile_commands.json并筛选任务，返回 (任务列表, 重复条目数, 是否复用边车文件)
+
+    安装了msgpack时，过滤结果保存在 <db>.filtered.msgpack 中；
+    compile_commands.json未变化时直接复用，跳过JSON解析、参数切分和过滤
+    """
+    if msgpack is not None:
+        cached = read_jobs_cache(db)
+        if cached is not None:
+            return (*cached, True)
+
+    jobs, dup = collect_jobs(load_entries(db))
+    if msgpack is not None:
+        write_jobs_cache(db, jobs, dup)
+    return jobs, dup, False
+
+
+def run(jobs, *, parallel=None, cache_dir=None, verify=False):
+    """直接编译生成干净的.bc文件，返回 (总文件数, 成功数, 失败数)
+
+    parallel 为 None 时使用CPU核数
+    """
+    if parallel is None:
+        parallel = default_jobs()
+    total = len(jobs)
+    success = 0
+    cached = 0
+    failed = 0
+    
+    print("开始编译干净的bitcode文件用于静态分析...")
+    print(f"编译器: {CLANG}")
+    print(f"优化等级: {OPTIMIZATION}")
+    print(f"并行任务数: {parallel}")
+    print("移除标志: sanitizers, profiling, stack protection, coverage")
+    if cache_dir is not None:
+        os.makedirs(cache_dir, exist_ok=True)
+        print(f"模式: 内容哈希缓存 ({cache_dir})，源文件和编译选项未变时跳过编译")
+    else:
+        print("模式: 强制重新编译所有文件")
+    if BC_OUTPUT_DIR:
+        print(f"输出: .bc文件将按源码树结构保存在 {BC_OUTPUT_DIR} 下")
+    else:
+        print("输出: .bc文件将保存在源文件相同目录下")
+    if verify:
+        print(f"检查: 使用 {LLVM_NM} 检查.bc中是否残留插桩符号")
+    print()
+    
+    # 在启动线程池之前完成编译器探测，避免各线程重复执行
+    integrated_cc1_flags()
+    if cache_dir is not None:
+        clang_version()
+
+    # 每个编译都在独立的clang子进程中执行，线程池即可并行
+    with ThreadPoolExecutor(max_workers=parallel) as pool:
+        futures = [pool.submit(compile_group, group, cache_dir=cache_dir, verify=verify)
+                   for group in group_jobs(jobs, parallel)]
+        for future in as_completed(futures):
+            for (src, _, bc_path, cwd, _), status, lines in future.result():
+                cwd_prefix = os.path.join(cwd, "")
+                if bc_path.startswith(cwd_prefix):
+                    bc_path = bc_path[len(cwd_prefix):]
+                print(f"编译: {src} -> {bc_path}")
+                for line in lines:
+                    print(line)
+                if status == "failed":
+                    failed += 1
+                else:
+                    success += 1
+                    if status == "cached":
+                        cached += 1
+    
+    # 输出统计信息
+    print()
+    print("=== 编译统计 ===")
+    print(f"总文件数: {total}")
+    print(f"成功编译: {success}")
+    if cache_dir is not None:
+        print(f"缓存命中: {cached}")
+    print(f"编译失败: {failed}")
+    print()
+    
+    if success > 0:
+        print(f"✓ 成功生成 {success} 个干净的 .bc 文件")
+        print("这些文件已移除插桩代码，适合静态分析")
+    else:
+        print("✗ 没有成功编译任何文件")
+    
+    return total, success, failed
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+# test_flags.py - 检查参数模板缓存与直接过滤的结果一致
+# 运行: python3 test_flags.py 或 python3 -m pytest test_flags.py
+import random
+
+from _flags import filter_flags_cached, filter_flags_for_analysis, filter_flags_template
+
+SRC = "drivers/x/a.c"
+
+KBUILD = [
+    "clang", "-Wp,-MMD,drivers/x/.a.o.d", "-nostdinc", "-Iinclude", "-D__KERNEL__", "-O2",
+    "-fsanitize=kernel-address", "-c", "-DKBUILD_MODFILE=\"drivers/x/a\"",
+    "-DKBUILD_BASENAME=\"a\"", "-DKBUILD_MODNAME=\"a\"", "-D__KBUILD_MODNAME=kmod_a",
+    "-o", "drivers/x/a.o", SRC,
+]
+
+# 成对选项后面的 -o/-Wp,/KBUILD_*/源文件 是选项参数，不能从模板中去掉或替换
+CASES = [
+    KBUILD,
+    ["clang", "-c", SRC],
+    ["clang", "-c", SRC, "-o"],
+    ["clang", "-o", SRC, "-c", SRC],
+    ["clang", "-I", "-o", "out.o", "-c", SRC],
+    ["clang", "-include", "-Wp,-MD,x.d", "-c", SRC],
+    ["clang", "-include", "-DKBUILD_MODNAME=\"a\"", "-c", SRC],
+    ["clang", "-include", SRC, "-c", SRC],
+    ["clang", "-mllvm", "-DKBUILD_BASENAME=\"a\"", "-c", SRC],
+    ["clang", "-MF", "-DKBUILD_BASENAME=\"a\"", "-DKBUILD_MODNAME=\"a\"", "-c", SRC],
+    ["clang", "-Wp,", "-DKBUILD_MODNAME=\"a\"", "-c", SRC],
+    ["clang", "-c", SRC, "-Wp,-MMD,a.d"],
+    ["clang", "-c", SRC, "-DKBUILD_MODFILE"],
+    ["clang", "-c", SRC, "-I"],
+    ["clang", "-c", SRC, "-Wp,-MMD,a.d", "-I"],
+    ["clang", "-DKBUILD_BASENAME=\"a\"", "-DKBUILD_BASENAME=\"a\"", "-g", "-g", "-c", SRC],
+    ["clang", "-O0", "-O3", "-c", "-DKBUILD_MODNAME=\"b\"", "-O2", SRC],
+]
+
+TOKENS = [
+    "-I", "inc", "-include", "cfg.h", "-isystem", "/usr/inc", "-mllvm", "-asan-stack=0",
+    "-o", "out.o", "-MF", "dep.d", "-MT", "t", "-Wp,", "-Wp,-MMD,a.d", "-c", "-E", "-MMD",
+    "-O0", "-O2", "-g", "-g0", "-DFOO", "-D__KERNEL__", "-DKBUILD_MODNAME=\"a\"",
+    "-DKBUILD_BASENAME=\"b\"", "-D__KBUILD_MODNAME=kmod_a", "-DKBUILD_MODFILE", "-UBAR",
+    "-fsanitize=address", "-fno-strict-aliasing", "-Wall", "-Wno-unused", "-m64", SRC,
+]
+
+
+def check(args):
+    expected = tuple(filter_flags_for_analysis(args))
+    assert filter_flags_template(args, SRC) == expected, args
+
+
+def test_cases():
+    for args in CASES:
+        check(args)
+
+
+def test_random_args():
+    rng = random.Random(0)
+    for _ in range(5000):
+        check(["clang"] + [rng.choice(TOKENS) for _ in range(rng.randint(0, 20))])
+
+
+def test_kbuild_template_shared():
+    filter_flags_cached.cache_clear()
+    for name in ("a", "b", "c"):
+        args = [a.replace("a", name) if "KBUILD" in a or a.startswith(("-Wp,", "drivers/")) else a
+                for a in KBUILD]
+        assert filter_flags_template(args, f"drivers/x/{name}.c") == tuple(filter_flags_for_analysis(args))
+    assert filter_flags_cached.cache_info().misses == 1
+
+
+if __name__ == "__main__":
+    test_cases()
+    test_random_args()
+    test_kbuild_template_shared()
+    print("ok")